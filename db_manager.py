@@ -1,13 +1,37 @@
-from sqlalchemy import create_engine, String,Integer, ForeignKey, select, delete, update,exc,func
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session,DeclarativeBase,Mapped,mapped_column,relationship,joinedload
+from sqlalchemy import create_engine, make_url, String,Integer, ForeignKey, Index, RowMapping, select, lambda_stmt, bindparam, insert, delete, update,exc,func,literal,inspect,text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import Session,DeclarativeBase,Mapped,mapped_column,relationship,joinedload,sessionmaker,defer
+from contextlib import contextmanager
+from typing import Iterator
+import logging
 import random
+import time
+import orjson
+import redis
 
-class NotFoundError(Exception):
+logger = logging.getLogger(__name__)
+
+# Seconds before DbManager reloads the cached list of recipe IDs
+RECIPE_ID_CACHE_TTL = 60
+# Redis key of the recipe ID list when DbManager is given a Redis client
+RECIPE_IDS_KEY = "recipe_ids"
+
+class DbError(Exception):
+    """Base class for the custom database exceptions; the message is kept in 'detail'."""
+    def __init__(self, detail:str):
+        super().__init__(detail)
+        self.detail = detail
+
+class NotFoundError(DbError):
     """Custom exception raised when a database record is not found."""
     pass
 
-class OtherError(Exception):
+class ConflictError(DbError):
+    """Custom exception raised when a write conflicts with existing data (e.g., a duplicate name)."""
+    pass
+
+class OtherError(DbError):
     """Custom exception for general, non-Integrity database errors."""
     pass
 
@@ -68,6 +92,13 @@ class RecipeIngredient(Base):
     This is used for many-to-many relationships and holds extra data (quantity).
     """
     __tablename__ = "recipe_ingredients"
+    __table_args__ = (
+        # Serves lookups by recipe and by (recipe, ingredient), and keeps each ingredient once per recipe
+        Index("ix_ri_recipe_ingredient", "recipe_id", "ingredient_id", unique=True),
+        # Serves lookups by ingredient (get_recipes_from_ingredient) and covers the
+        # ingredient filter + recipe grouping in get_common_recipes without touching the table
+        Index("ix_ri_ingredient_recipe", "ingredient_id", "recipe_id"),
+    )
 
     # Primary Key
     recipe_ingredients_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
@@ -81,34 +112,133 @@ class RecipeIngredient(Base):
     ingredient: Mapped["Ingredient"] = relationship(back_populates="recipe_associations")
     recipe: Mapped["Recipe"] = relationship(back_populates="ingredient_associations")
 
+# Column attributes by name, built once at import so dynamic lookups and partial updates
+# do a single dict probe and reuse the same column objects
+_INGREDIENT_COLUMNS = {column.key: getattr(Ingredient, column.key) for column in Ingredient.__table__.c}
+_RECIPE_COLUMNS = {column.key: getattr(Recipe, column.key) for column in Recipe.__table__.c}
+# Columns get_ingredient_id/get_recipe_id may filter on; each is a primary key or unique
+_INGREDIENT_LOOKUP_KEYS = frozenset({"ingredient_id", "ingredient_name"})
+_RECIPE_LOOKUP_KEYS = frozenset({"recipe_id", "recipe_name"})
+
+# Dialect-specific INSERT constructs supporting ON CONFLICT DO NOTHING, keyed by dialect name
+_ON_CONFLICT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+# Hot lookups and existence probes, built once as lambda statements so their compiled form is cached
+# by the lambda's code location. Parameters: r (recipe ID), i (ingredient ID).
+_STMT_RECIPE_INGREDIENT = lambda_stmt(lambda: select(RecipeIngredient)
+    .options(joinedload(RecipeIngredient.ingredient))
+    .where(RecipeIngredient.recipe_id == bindparam("r"))
+    .where(RecipeIngredient.ingredient_id == bindparam("i")))
+_STMT_RECIPE_INGREDIENTS = lambda_stmt(lambda: select(RecipeIngredient)
+    .options(joinedload(RecipeIngredient.ingredient))
+    .where(RecipeIngredient.recipe_id == bindparam("r")))
+_STMT_RECIPE_EXISTS = lambda_stmt(lambda: select(literal(1))
+    .where(Recipe.recipe_id == bindparam("r"))
+    .limit(1))
+_STMT_INGREDIENT_EXISTS = lambda_stmt(lambda: select(literal(1))
+    .where(Ingredient.ingredient_id == bindparam("i"))
+    .limit(1))
+_STMT_RECIPE_INGREDIENT_EXISTS = lambda_stmt(lambda: select(literal(1))
+    .select_from(RecipeIngredient)
+    .where(RecipeIngredient.recipe_id == bindparam("r"))
+    .where(RecipeIngredient.ingredient_id == bindparam("i"))
+    .limit(1))
+
 
 class DbManager:
     """
     Manages database connection and provides CRUD (Create, Read, Update, Delete)
     and utility operations for Ingredients, Recipes, and their associations.
     """
-    def __init__(self,engine:str):
+    def __init__(self,engine:str,pool_size:int=20,max_overflow:int=10,cache:redis.Redis| None=None):
         """
         Initializes the DbManager with a SQLAlchemy engine.
 
+        Each worker process holds up to pool_size + max_overflow connections, so
+        workers * (pool_size + max_overflow) must stay below the server's max_connections.
+
         Args:
             engine (str): The database connection string (e.g., 'sqlite:///recipes.db').
+            pool_size (int): Connections kept open in the pool.
+            max_overflow (int): Extra connections allowed above pool_size under load.
+                Both are ignored for URLs whose pool isn't sized (e.g., in-memory SQLite).
+            cache (redis.Redis | None): Optional Redis client. When given, the recipe ID list used by
+                get_random_recipe is kept there and shared between worker processes.
         """
-        self.engine=create_engine(engine)
+        url=make_url(engine)
+        pool_options={}
+        # Only QueuePool takes a size; in-memory SQLite uses SingletonThreadPool, which rejects it
+        if issubclass(url.get_dialect().get_pool_class(url),QueuePool):
+            pool_options={"pool_size":pool_size,"max_overflow":max_overflow}
+        # Larger compiled-statement cache so the dynamic lookups stay cached alongside the CRUD queries.
+        # The pool checks a connection is alive before handing it out and
+        # recycles connections before the server drops them as idle.
+        self.engine=create_engine(url,query_cache_size=1200,
+                                  pool_pre_ping=True,pool_recycle=1800,**pool_options)
+        # Objects stay loaded after commit, so returning them doesn't trigger a refresh query
+        self._session_factory=sessionmaker(bind=self.engine,expire_on_commit=False)
         self.create_database() # Auto-create tables on initialization
+        # IDs of every recipe for get_random_recipe, kept in Redis when configured and in this
+        # process otherwise; reloaded after RECIPE_ID_CACHE_TTL seconds or once a commit
+        # adds or deletes a recipe
+        self._cache=cache
+        self._all_recipe_ids: tuple[int,...] | None=None
+        self._all_recipe_ids_loaded_at=0.0
 
     def create_database(self):
-        """Creates all defined tables in the database if they don't already exist."""
+        """
+        Creates all defined tables in the database if they don't already exist.
+        Tables created by an older version of the models are left as they are;
+        run upgrade_database once to add their missing indexes.
+        """
         Base.metadata.create_all(self.engine)
+        existing = {index["name"] for index in inspect(self.engine).get_indexes(RecipeIngredient.__tablename__)}
+        if "ix_ri_recipe_ingredient" not in existing:
+            logger.warning("Index ix_ri_recipe_ingredient is missing, so adding ingredients to recipes will fail. "
+                           "Upgrade the database once with 'python db_manager.py'.")
+
+    def upgrade_database(self):
+        """
+        One-off upgrade for databases created before the association indexes existed.
+        Creates every index missing from the existing tables and drops the retired ingredient_unit
+        index. The unique (recipe_id, ingredient_id) index can't be built over duplicate associations,
+        so for each duplicated pair only the oldest row is kept; every removed row is logged with its quantity.
+
+        Run it from a single process while the API is stopped (python db_manager.py).
+        """
+        with self.engine.begin() as connection:
+            inspector = inspect(connection)
+            existing = {index["name"] for index in inspector.get_indexes(RecipeIngredient.__tablename__)}
+            if "ix_ri_recipe_ingredient" not in existing:
+                oldest = (select(func.min(RecipeIngredient.recipe_ingredients_id))
+                          .group_by(RecipeIngredient.recipe_id, RecipeIngredient.ingredient_id))
+                duplicates = connection.execute(delete(RecipeIngredient)
+                    .where(RecipeIngredient.recipe_ingredients_id.notin_(oldest))
+                    .returning(RecipeIngredient.recipe_ingredients_id, RecipeIngredient.recipe_id,
+                               RecipeIngredient.ingredient_id, RecipeIngredient.ingredient_quantity)).all()
+                for row in duplicates:
+                    logger.warning("Removed duplicate association %s: recipe %s, ingredient %s, quantity %s",
+                                   row.recipe_ingredients_id, row.recipe_id, row.ingredient_id, row.ingredient_quantity)
+            # Earlier versions indexed ingredient_unit, which is too low-cardinality to be worth the writes
+            if "ix_ingredients_ingredient_unit" in {index["name"] for index in inspector.get_indexes(Ingredient.__tablename__)}:
+                logger.info("Dropping index ix_ingredients_ingredient_unit")
+                connection.execute(text("DROP INDEX ix_ingredients_ingredient_unit"))
+            # create_all skips indexes on tables that already exist
+            for table in Base.metadata.sorted_tables:
+                present = {index["name"] for index in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in present:
+                        logger.info("Creating index %s", index.name)
+                        index.create(connection)
 
     def get_session(self)->Session:
         """
-        Returns a new SQLAlchemy Session bound to the engine.
+        Returns a new SQLAlchemy Session from the manager's session factory.
 
         Returns:
             Session: A new database session.
         """
-        return Session(self.engine)
+        return self._session_factory()
 
     def commit_session(self, session:Session):
         """
@@ -118,23 +248,74 @@ class DbManager:
             session (Session): The active SQLAlchemy session.
 
         Raises:
-            IntegrityError: If a database constraint is violated (e.g., unique name conflict).
+            ConflictError: If a database constraint is violated (e.g., unique name conflict).
             OtherError: For any other general database exception.
 
         Returns:
             bool: True if the commit was successful.
         """
+        # Set by add_recipe/delete_recipe_by_id; the ID list is only dropped once the change is committed
+        recipe_ids_stale=session.info.pop("recipe_ids_stale",False)
         try:
             session.commit()
         except exc.IntegrityError as e:
             session.rollback()
-            raise IntegrityError(e)
+            raise ConflictError(str(e.orig)) from e
         except Exception as e:
             session.rollback()
-            raise OtherError(e)
+            raise OtherError(str(e)) from e
         else:
+            if recipe_ids_stale:
+                self._drop_recipe_ids()
             return True
 
+    def flush_session(self, session:Session):
+        """
+        Flushes pending changes to the database without committing, so generated
+        primary keys are available while the caller keeps the transaction open.
+
+        Args:
+            session (Session): The active SQLAlchemy session.
+
+        Raises:
+            ConflictError: If a database constraint is violated (e.g., unique name conflict).
+            OtherError: For any other general database exception.
+
+        Returns:
+            bool: True if the flush was successful.
+        """
+        try:
+            session.flush()
+        except exc.IntegrityError as e:
+            session.rollback()
+            raise ConflictError(str(e.orig)) from e
+        except Exception as e:
+            session.rollback()
+            raise OtherError(str(e)) from e
+        else:
+            return True
+
+    @contextmanager
+    def transaction(self)->Iterator[Session]:
+        """
+        Opens a session for one logical unit of work and commits it once on exit.
+        The transaction is rolled back if the block raises.
+
+        Usage:
+            with db.transaction() as session:
+                db.add_ingredient(session, ...)
+
+        Yields:
+            Session: A new database session.
+        """
+        with self.get_session() as session:
+            try:
+                yield session
+            except Exception:
+                session.rollback()
+                raise
+            self.commit_session(session)
+
     #    INGREDIENT CRUD #
 
     def add_ingredient(self,session:Session
@@ -142,6 +323,7 @@ class DbManager:
                         )->int| None:
         """
         Adds a new ingredient to the database.
+        The row is flushed but not committed; commit once per unit of work (see transaction).
 
         Args:
             session (Session): The active SQLAlchemy session.
@@ -158,7 +340,8 @@ class DbManager:
                 ingredient_unit=ingredient_unit
             )
         session.add(new_ingredient)
-        if self.commit_session(session):
+        if self.flush_session(session):
+            session.info.pop("ingredient_ids",None)
             return new_ingredient.ingredient_id
 
     def get_all_ingredients(self,session:Session)->list[Ingredient]| None:
@@ -173,6 +356,19 @@ class DbManager:
         """
         return session.scalars(select(Ingredient).order_by(Ingredient.ingredient_id)).all()
 
+    def get_all_ingredients_lightweight(self,session:Session)->list[RowMapping]:
+        """
+        Retrieves all ingredients as plain column mappings rather than ORM objects,
+        skipping identity-map and instance-state overhead for list endpoints.
+
+        Args:
+            session (Session): The active SQLAlchemy session.
+
+        Returns:
+            list[RowMapping]: One mapping of column name to value per ingredient, ordered by ID.
+        """
+        return session.execute(select(*Ingredient.__table__.c).order_by(Ingredient.ingredient_id)).mappings().all()
+
     def get_ingredient_by_id(self,session:Session, id:int)->Ingredient| None:
         """
         Retrieves a single ingredient by its primary key ID.
@@ -199,25 +395,37 @@ class DbManager:
 
         Args:
             session (Session): The active SQLAlchemy session.
-            key (str): The attribute/column name (e.g., 'ingredient_name').
+            key (str): The column name; one of the indexed columns in _INGREDIENT_LOOKUP_KEYS.
             value: The value to match.
 
         Raises:
+            ValueError: If the key is not an indexed lookup column.
             NotFoundError: If no ingredient is found matching the criteria.
 
         Returns:
             int | None: The ID of the matching ingredient.
         """
-        if hasattr(Ingredient,key):
-            # Dynamic filtering based on attribute name (key) and value
-            ingredient=session.scalars(select(Ingredient).where(getattr(Ingredient,key)==value)).first()
-            if not ingredient:
-                raise NotFoundError("Ingredient Not Found.")
-            return ingredient.ingredient_id
+        if key=="ingredient_id":
+            # Primary key lookups go through session.get, which checks the identity map first
+            return self.get_ingredient_by_id(session,value).ingredient_id
+        if key not in _INGREDIENT_LOOKUP_KEYS:
+            raise ValueError(f"Cannot look up ingredients by '{key}'.")
+        # (key, value) -> id cache kept on the session, so it dies with the request and its transaction
+        ingredient_ids=session.info.setdefault("ingredient_ids",{})
+        cached_id=ingredient_ids.get((key,value))
+        if cached_id is not None:
+            return cached_id
+        # Dynamic filtering based on column name (key) and value, fetching only the ID
+        ingredient_id=session.scalars(select(Ingredient.ingredient_id).where(_INGREDIENT_COLUMNS[key]==value)).first()
+        if ingredient_id is None:
+            raise NotFoundError("Ingredient Not Found.")
+        ingredient_ids[(key,value)]=ingredient_id
+        return ingredient_id
 
     def update_ingredient_by_id(self,session:Session, id:int, **kwargs)->int| None:
         """
         Updates one or more attributes of an existing ingredient by its ID.
+        The changes are flushed but not committed; commit once per unit of work (see transaction).
 
         Args:
             session (Session): The active SQLAlchemy session.
@@ -230,20 +438,27 @@ class DbManager:
         Returns:
             int | None: The ID of the updated ingredient if successful.
         """
-        ingredient=session.get(Ingredient,id)
-        if not ingredient:
+        # Keep only the keys that are columns of the table
+        values={key:value for key,value in kwargs.items() if key in _INGREDIENT_COLUMNS}
+        if values:
+            # Single UPDATE ... RETURNING, without loading the ingredient first
+            ingredient_id=session.execute(update(Ingredient)
+                .where(Ingredient.ingredient_id==id)
+                .values(**values)
+                .returning(Ingredient.ingredient_id)).scalar_one_or_none()
+        else:
+            ingredient_id=session.scalar(select(Ingredient.ingredient_id).where(Ingredient.ingredient_id==id))
+        if ingredient_id is None:
             raise NotFoundError("Ingredient Not Found.")
-        for key,value in kwargs.items():
-            # Set the attribute if it exists on the model
-            if hasattr(ingredient, key):
-                setattr(ingredient,key,value)
-        if self.commit_session(session):
-            return ingredient.ingredient_id
+        if self.flush_session(session):
+            session.info.pop("ingredient_ids",None)
+            return ingredient_id
 
     def delete_ingredient_by_id(self,session:Session, id:int)->Ingredient| None:
         """
         Deletes an ingredient by its ID. Due to the cascade setting,
         associated RecipeIngredient entries will also be deleted.
+        The changes are flushed but not committed; commit once per unit of work (see transaction).
 
         Args:
             session (Session): The active SQLAlchemy session.
@@ -259,7 +474,8 @@ class DbManager:
         if not ingredient:
             raise NotFoundError("Ingredient Not Found.")
         session.delete(ingredient)
-        if self.commit_session(session):
+        if self.flush_session(session):
+            session.info.pop("ingredient_ids",None)
             return ingredient
 
     #    RECIPE CRUD #
@@ -270,6 +486,7 @@ class DbManager:
                     ,recipe_fat: float,recipe_carbs:float)->int| None:
         """
         Adds a new recipe to the database.
+        The row is flushed but not committed; commit once per unit of work (see transaction).
 
         Args:
             session (Session): The active SQLAlchemy session.
@@ -296,7 +513,9 @@ class DbManager:
                 recipe_carbs=recipe_carbs
             )
         session.add(new_recipe)
-        if self.commit_session(session):
+        if self.flush_session(session):
+            session.info.pop("recipe_ids",None)
+            session.info["recipe_ids_stale"]=True
             return new_recipe.recipe_id
 
     def get_all_recipes(self,session:Session)->list[Recipe]| None:
@@ -307,9 +526,25 @@ class DbManager:
             session (Session): The active SQLAlchemy session.
 
         Returns:
-            list[Recipe] | None: A list of all Recipe objects, ordered by ID.
+            list[Recipe] | None: A list of all Recipe objects, ordered by ID. The instructions
+            are not loaded; use get_recipe_by_id for the full recipe.
+        """
+        # Leave the (up to 5000 character) instructions out of the list query
+        return session.scalars(select(Recipe)
+            .options(defer(Recipe.recipe_instructions))
+            .order_by(Recipe.recipe_id)).all()
+
+    def get_all_recipe_ids(self,session:Session)->list[int]:
+        """
+        Retrieves the IDs of all recipes without loading the recipes themselves.
+
+        Args:
+            session (Session): The active SQLAlchemy session.
+
+        Returns:
+            list[int]: The ID of every recipe in the database.
         """
-        return session.scalars(select(Recipe).order_by(Recipe.recipe_id)).all()
+        return list(session.scalars(select(Recipe.recipe_id)))
 
     def get_recipe_by_id(self,session:Session, id:int)->Recipe| None:
         """
@@ -334,6 +569,7 @@ class DbManager:
     def update_recipe_by_id(self,session:Session, id:int, **kwargs)->int| None:
         """
         Updates one or more attributes of an existing recipe by its ID.
+        The changes are flushed but not committed; commit once per unit of work (see transaction).
 
         Args:
             session (Session): The active SQLAlchemy session.
@@ -346,20 +582,27 @@ class DbManager:
         Returns:
             int | None: The ID of the updated recipe if successful.
         """
-        recipe=session.get(Recipe,id)
-        if not recipe:
+        # Keep only the keys that are columns of the table
+        values={key:value for key,value in kwargs.items() if key in _RECIPE_COLUMNS}
+        if values:
+            # Single UPDATE ... RETURNING, without loading the recipe first
+            recipe_id=session.execute(update(Recipe)
+                .where(Recipe.recipe_id==id)
+                .values(**values)
+                .returning(Recipe.recipe_id)).scalar_one_or_none()
+        else:
+            recipe_id=session.scalar(select(Recipe.recipe_id).where(Recipe.recipe_id==id))
+        if recipe_id is None:
             raise NotFoundError("Recipe Not Found.")
-        for key,value in kwargs.items():
-            # Set the attribute if it exists on the model
-            if hasattr(recipe, key):
-                setattr(recipe,key,value)
-        if self.commit_session(session):
-            return recipe.recipe_id
+        if self.flush_session(session):
+            session.info.pop("recipe_ids",None)
+            return recipe_id
 
     def delete_recipe_by_id(self,session:Session, id:int)->Recipe| None:
         """
-        Deletes a recipe by its ID. Due to the cascade setting,
-        associated RecipeIngredient entries will also be deleted.
+        Deletes a recipe by its ID. Associated RecipeIngredient entries are also deleted,
+        in one bulk statement rather than through the ORM cascade.
+        The changes are flushed but not committed; commit once per unit of work (see transaction).
 
         Args:
             session (Session): The active SQLAlchemy session.
@@ -371,11 +614,17 @@ class DbManager:
         Returns:
             Recipe | None: The Recipe object that was deleted.
         """
-        recipe=session.get(Recipe,id)
+        # Remove the associations first so the recipe row can go without loading the collection,
+        # then delete the recipe and get it back in the same statement
+        session.execute(delete(RecipeIngredient)
+                        .where(RecipeIngredient.recipe_id==id)
+                        .execution_options(synchronize_session=False))
+        recipe=session.scalars(delete(Recipe).where(Recipe.recipe_id==id).returning(Recipe)).one_or_none()
         if not recipe:
             raise NotFoundError("Recipe Not Found.")
-        session.delete(recipe)
-        if self.commit_session(session):
+        if self.flush_session(session):
+            session.info.pop("recipe_ids",None)
+            session.info["recipe_ids_stale"]=True
             return recipe
 
     def get_recipe_id(self,session:Session,key:str,value)->int| None:
@@ -384,21 +633,73 @@ class DbManager:
 
         Args:
             session (Session): The active SQLAlchemy session.
-            key (str): The attribute/column name (e.g., 'recipe_name').
+            key (str): The column name; one of the indexed columns in _RECIPE_LOOKUP_KEYS.
             value: The value to match.
 
         Raises:
+            ValueError: If the key is not an indexed lookup column.
             NotFoundError: If no recipe is found matching the criteria.
 
         Returns:
             int | None: The ID of the matching recipe.
         """
-        if hasattr(Recipe,key):
-            # Dynamic filtering based on attribute name (key) and value
-            recipe=session.scalars(select(Recipe).where(getattr(Recipe,key)==value)).first()
-            if not recipe:
-                raise NotFoundError("Recipe Not Found.")
-            return recipe.recipe_id
+        if key=="recipe_id":
+            # Primary key lookups go through session.get, which checks the identity map first
+            return self.get_recipe_by_id(session,value).recipe_id
+        if key not in _RECIPE_LOOKUP_KEYS:
+            raise ValueError(f"Cannot look up recipes by '{key}'.")
+        # (key, value) -> id cache kept on the session, so it dies with the request and its transaction
+        recipe_ids=session.info.setdefault("recipe_ids",{})
+        cached_id=recipe_ids.get((key,value))
+        if cached_id is not None:
+            return cached_id
+        # Dynamic filtering based on column name (key) and value, fetching only the ID
+        recipe_id=session.scalars(select(Recipe.recipe_id).where(_RECIPE_COLUMNS[key]==value)).first()
+        if recipe_id is None:
+            raise NotFoundError("Recipe Not Found.")
+        recipe_ids[(key,value)]=recipe_id
+        return recipe_id
+
+    def _recipe_exists(self,session:Session,id:int)->bool:
+        """
+        Checks whether a recipe exists without loading the Recipe row.
+
+        Args:
+            session (Session): The active SQLAlchemy session.
+            id (int): The recipe ID.
+
+        Returns:
+            bool: True if a recipe with the given ID exists.
+        """
+        return session.scalar(_STMT_RECIPE_EXISTS,{"r":id}) is not None
+
+    def _ingredient_exists(self,session:Session,id:int)->bool:
+        """
+        Checks whether an ingredient exists without loading the Ingredient row.
+
+        Args:
+            session (Session): The active SQLAlchemy session.
+            id (int): The ingredient ID.
+
+        Returns:
+            bool: True if an ingredient with the given ID exists.
+        """
+        return session.scalar(_STMT_INGREDIENT_EXISTS,{"i":id}) is not None
+
+    def _recipe_ingredient_exists(self,session:Session,recipe:int,ingredient:int)->bool:
+        """
+        Checks whether an ingredient is associated with a recipe without loading the association.
+        The lookup only touches the (recipe_id, ingredient_id) index.
+
+        Args:
+            session (Session): The active SQLAlchemy session.
+            recipe (int): The ID of the recipe.
+            ingredient (int): The ID of the ingredient.
+
+        Returns:
+            bool: True if the association exists.
+        """
+        return session.scalar(_STMT_RECIPE_INGREDIENT_EXISTS,{"r":recipe,"i":ingredient}) is not None
 
     #    RECIPE_INGREDIENT CRUD  #
 
@@ -417,32 +718,21 @@ class DbManager:
         Returns:
             dict: A dictionary containing the 'ingredient' object and the 'quantity'.
         """
-        try:
-            # Check if the recipe exists
-            self.get_recipe_by_id(session,recipe)
-        except NotFoundError as e:
-            raise NotFoundError(e)
-        else:
-            # Construct the query to find the association, eagerly loading the Ingredient object
-            stmt = (
-                select(RecipeIngredient)
-                .options(joinedload(RecipeIngredient.ingredient))
-                .where(RecipeIngredient.recipe_id == recipe)
-                .where(RecipeIngredient.ingredient_id == ingredient)
-            )
-
-            result = session.scalars(stmt).first()
-
-            if result:
-                return {
-                    "ingredient": result.ingredient,
-                    "quantity": result.ingredient_quantity
-                }
-            else:
-                raise NotFoundError("Recipe Ingredient Not Found.")
+        # Find the association, eagerly loading the Ingredient object
+        result = session.scalars(_STMT_RECIPE_INGREDIENT,{"r":recipe,"i":ingredient}).first()
+
+        if result:
+            return {
+                "ingredient": result.ingredient,
+                "quantity": result.ingredient_quantity
+            }
+        # Only check the recipe on a miss, to report which of the two is missing
+        if not self._recipe_exists(session,recipe):
+            raise NotFoundError("Recipe Not Found.")
+        raise NotFoundError("Recipe Ingredient Not Found.")
 
 
-    def get_all_recipe_ingredients(self,session:Session,recipe:int)->list[dict]:
+    def get_all_recipe_ingredients(self,session:Session,recipe:int)->list[RecipeIngredient]:
         """
         Retrieves all ingredients (with quantities) for a given recipe.
 
@@ -454,29 +744,23 @@ class DbManager:
             NotFoundError: If the recipe is not found or it has no ingredients.
 
         Returns:
-            list[dict]: A list of dictionaries, each containing the 'ingredient' object and 'quantity'.
+            list[RecipeIngredient]: The recipe's associations, with 'ingredient' loaded
+            and the quantity in 'ingredient_quantity'.
         """
-        try:
-            # Check if the recipe exists
-            self.get_recipe_by_id(session,recipe)
-        except NotFoundError as e:
-            raise NotFoundError(e)
-        else:
-            # Select all RecipeIngredient associations for the recipe, eagerly loading Ingredient data
-            result= session.scalars(
-                select(RecipeIngredient)
-                .options(joinedload(RecipeIngredient.ingredient))
-                .where(RecipeIngredient.recipe_id== recipe)).all()
-            if result:
-                # Format the result into a list of dictionaries
-                return [{"ingredient": row.ingredient,"quantity": row.ingredient_quantity} for row in result]
-            else:
-                raise NotFoundError("Recipe Ingredients Not found.")
+        # Select all RecipeIngredient associations for the recipe, eagerly loading Ingredient data
+        result= session.scalars(_STMT_RECIPE_INGREDIENTS,{"r":recipe}).all()
+        if result:
+            return result
+        # Only check the recipe on a miss, to report which of the two is missing
+        if not self._recipe_exists(session,recipe):
+            raise NotFoundError("Recipe Not Found.")
+        raise NotFoundError("Recipe Ingredients Not found.")
 
 
     def add_recipe_ingredients(self,session:Session,recipe:int,ingredient:int,qty:float)->int| None:
         """
         Adds an ingredient with its quantity to a specific recipe.
+        The row is flushed but not committed; commit once per unit of work (see transaction).
 
         Args:
             session (Session): The active SQLAlchemy session.
@@ -486,34 +770,86 @@ class DbManager:
 
         Raises:
             NotFoundError: If the recipe or ingredient are not found.
-            IntegrityError: If the ingredient is already associated with the recipe.
+            ConflictError: If the ingredient is already associated with the recipe.
 
         Returns:
             int | None: The ID of the newly created RecipeIngredient association.
         """
-        try:
-            # Check if the recipe exists
-            self.get_recipe_by_id(session,recipe)
-        except NotFoundError as e:
-            raise NotFoundError(e)
-        else:
-            try:
-                # Check if the ingredient is already in the recipe
-                self.get_recipe_ingredient(session,recipe,ingredient)
-            except NotFoundError:
-                # Only add if it doesn't already exist (catching NotFoundError)
-                recipe_ing=RecipeIngredient(recipe_id=recipe,ingredient_id=ingredient,ingredient_quantity=qty)
-                session.add(recipe_ing)
-                if self.commit_session(session):
-                    return recipe_ing.recipe_ingredients_id
-            else:
-                # If get_recipe_ingredient succeeds, it means the association exists
-                raise IntegrityError("Ingredient already exists for the recipe.")
+        if not self._recipe_exists(session,recipe):
+            raise NotFoundError("Recipe Not Found.")
+        if not self._ingredient_exists(session,ingredient):
+            raise NotFoundError("Ingredient Not Found.")
+        dialect_insert=_ON_CONFLICT_INSERTS.get(session.get_bind().dialect.name)
+        if dialect_insert is None:
+            # Check if the ingredient is already in the recipe without loading the association
+            if self._recipe_ingredient_exists(session,recipe,ingredient):
+                raise ConflictError("Ingredient already exists for the recipe.")
+            recipe_ing=RecipeIngredient(recipe_id=recipe,ingredient_id=ingredient,ingredient_quantity=qty)
+            session.add(recipe_ing)
+            if self.flush_session(session):
+                return recipe_ing.recipe_ingredients_id
+            return None
+        # Insert and detect a duplicate in one atomic statement; no row comes back on conflict
+        recipe_ingredient_id=session.execute(dialect_insert(RecipeIngredient)
+            .values(recipe_id=recipe,ingredient_id=ingredient,ingredient_quantity=qty)
+            .on_conflict_do_nothing(index_elements=["recipe_id","ingredient_id"])
+            .returning(RecipeIngredient.recipe_ingredients_id)).scalar()
+        if recipe_ingredient_id is None:
+            raise ConflictError("Ingredient already exists for the recipe.")
+        return recipe_ingredient_id
+
+
+    def add_recipe_ingredients_bulk(self,session:Session,recipe:int,pairs:list[tuple[int,float]])->list[int]:
+        """
+        Adds several ingredients with their quantities to a recipe in a single INSERT.
+        Ingredients already associated with the recipe are skipped.
+        The rows are flushed but not committed; commit once per unit of work (see transaction).
+
+        Args:
+            session (Session): The active SQLAlchemy session.
+            recipe (int): The ID of the recipe.
+            pairs (list[tuple[int, float]]): (ingredient ID, quantity) pairs to add.
+
+        Raises:
+            NotFoundError: If the recipe or any of the ingredients are not found.
+
+        Returns:
+            list[int]: The IDs of the RecipeIngredient associations created.
+        """
+        if not self._recipe_exists(session,recipe):
+            raise NotFoundError("Recipe Not Found.")
+        # Collapse repeated ingredients in the request, the last quantity wins
+        quantities=dict(pairs)
+        if not quantities:
+            return []
+        # Check every ingredient in one query, so none of the rows is inserted if one is missing
+        found=set(session.scalars(select(Ingredient.ingredient_id).where(Ingredient.ingredient_id.in_(quantities))))
+        if found!=quantities.keys():
+            raise NotFoundError("Ingredient Not Found.")
+        rows=[{"recipe_id":recipe,"ingredient_id":ingredient,"ingredient_quantity":qty}
+              for ingredient,qty in quantities.items()]
+        dialect_insert=_ON_CONFLICT_INSERTS.get(session.get_bind().dialect.name)
+        if dialect_insert is not None:
+            # One multi-row INSERT; rows that already exist are skipped and only new IDs come back
+            return list(session.execute(dialect_insert(RecipeIngredient)
+                .values(rows)
+                .on_conflict_do_nothing(index_elements=["recipe_id","ingredient_id"])
+                .returning(RecipeIngredient.recipe_ingredients_id)).scalars())
+        # Diff against the ingredients already in the recipe so only new rows are inserted
+        existing=set(session.scalars(select(RecipeIngredient.ingredient_id)
+                                     .where(RecipeIngredient.recipe_id==recipe)).all())
+        rows=[row for row in rows if row["ingredient_id"] not in existing]
+        if not rows:
+            return []
+        recipe_ingredient_ids=list(session.scalars(insert(RecipeIngredient).returning(RecipeIngredient.recipe_ingredients_id),rows))
+        if self.flush_session(session):
+            return recipe_ingredient_ids
 
 
     def update_recipe_qty(self,session:Session,recipe:int,ingredient:int,quantity:float)->int| None:
         """
         Updates the quantity of an ingredient in a specific recipe.
+        The changes are flushed but not committed; commit once per unit of work (see transaction).
 
         Args:
             session (Session): The active SQLAlchemy session.
@@ -527,39 +863,24 @@ class DbManager:
         Returns:
             int | None: The ID of the updated RecipeIngredient association.
         """
-        try:
-            # Check if the recipe exists
-            self.get_recipe_by_id(session,recipe)
-        except NotFoundError as e:
-            raise NotFoundError(e)
-        else:
-            # Use an update statement for efficiency
-            recipe_ingredient=session.execute(update(RecipeIngredient)
-                .where(RecipeIngredient.recipe_id == recipe)
-                .where(RecipeIngredient.ingredient_id == ingredient)
-                .values(ingredient_quantity=quantity))
-
-            # Note: Checking for existence via update result is tricky with ORM.
-            # A more robust check might involve using get_recipe_ingredient first,
-            # but since we commit *after* the update, we'll keep the existing flow.
-            # The commit will fail if the recipe or ingredient doesn't exist due to foreign keys.
-            # However, the update statement returns a result object, not the row ID.
-
-            # We need to rethink how to return the ID, since session.execute().rowcount
-            # is typically used for update statements. For now, rely on commit success.
-            # I will not modify your code structure to ensure I meet your rule.
-            # *Self-Correction: I will not raise NotFoundError based on 'recipe_ingredient' variable here.*
-            # *The original code had a potential issue here with `return recipe_ingredient.recipe_ingredients_id`
-            # *since `recipe_ingredient` is the result of `session.execute(update(...))` and not a single ORM object.*
-            # *I will return None on success as a compromise to adhere to the rule of not changing sections.*
-            if self.commit_session(session):
-                 # Cannot reliably return recipe_ingredients_id from execute(update) without a separate select.
-                return None
+        # Update the quantity and get the association's ID back in the same statement
+        recipe_ingredient_id=session.execute(update(RecipeIngredient)
+            .where(RecipeIngredient.recipe_id == recipe)
+            .where(RecipeIngredient.ingredient_id == ingredient)
+            .values(ingredient_quantity=quantity)
+            .returning(RecipeIngredient.recipe_ingredients_id)).scalar_one_or_none()
+        if recipe_ingredient_id is None:
+            if not self._recipe_exists(session,recipe):
+                raise NotFoundError("Recipe Not Found.")
+            raise NotFoundError("Recipe Ingredient Not found.")
+        if self.flush_session(session):
+            return recipe_ingredient_id
 
 
     def delete_recipe_ingredient(self,session:Session,recipe:int,ingredient:int)->int| None:
         """
         Deletes a single ingredient association from a recipe.
+        The changes are flushed but not committed; commit once per unit of work (see transaction).
 
         Args:
             session (Session): The active SQLAlchemy session.
@@ -572,25 +893,22 @@ class DbManager:
         Returns:
             int | None: The ID of the RecipeIngredient association that was deleted.
         """
-        try:
-            # Check if the recipe exists
-            self.get_recipe_by_id(session,recipe)
-        except NotFoundError as e:
-            raise NotFoundError(e)
-        else:
-            # Find the specific RecipeIngredient association object
-            recipe_ingredient=session.scalars(select(RecipeIngredient)
-                                             .where(RecipeIngredient.recipe_id==recipe)
-                                             .where(RecipeIngredient.ingredient_id==ingredient)).first()
-            if not recipe_ingredient:
-                raise NotFoundError("Recipe Ingredient Not found.")
-            session.delete(recipe_ingredient)
-            if self.commit_session(session):
-                return recipe_ingredient.recipe_ingredients_id
-
-    def delete_all_recipe_ingredients(self,session:Session,recipe:int)->Recipe| None:
+        # Delete the association and get its ID back in the same statement
+        recipe_ingredient_id=session.execute(delete(RecipeIngredient)
+            .where(RecipeIngredient.recipe_id==recipe)
+            .where(RecipeIngredient.ingredient_id==ingredient)
+            .returning(RecipeIngredient.recipe_ingredients_id)).scalar_one_or_none()
+        if recipe_ingredient_id is None:
+            if not self._recipe_exists(session,recipe):
+                raise NotFoundError("Recipe Not Found.")
+            raise NotFoundError("Recipe Ingredient Not found.")
+        if self.flush_session(session):
+            return recipe_ingredient_id
+
+    def delete_all_recipe_ingredients(self,session:Session,recipe:int)->int| None:
         """
         Deletes all ingredient associations for a given recipe.
+        The changes are flushed but not committed; commit once per unit of work (see transaction).
 
         Args:
             session (Session): The active SQLAlchemy session.
@@ -600,36 +918,93 @@ class DbManager:
             NotFoundError: If the recipe is not found.
 
         Returns:
-            Recipe | None: The Recipe object whose ingredients were cleared.
+            int | None: The number of RecipeIngredient associations deleted.
         """
-        try:
-            # Check if the recipe exists and retrieve it
-            target_recipe=self.get_recipe_by_id(session,recipe)
-        except NotFoundError as e:
-            raise NotFoundError(e)
-        else:
-            # Execute a bulk delete statement for all associations matching the recipe ID
-            recipe=session.execute(delete(RecipeIngredient).where(RecipeIngredient.recipe_id==recipe))
-
-            # Note: The result of session.execute(delete(...)) is a Result object, not the Recipe object.
-            # The check `if not recipe:` is generally not how to check a successful delete with ORM.
-            # I will not change the original section, relying on the `commit_session` to confirm success.
-
-            if self.commit_session(session):
-                    return target_recipe
+        # Execute a bulk delete statement for all associations matching the recipe ID,
+        # without reconciling the deleted rows against objects in the session
+        result=session.execute(delete(RecipeIngredient)
+                               .where(RecipeIngredient.recipe_id==recipe)
+                               .execution_options(synchronize_session=False))
+        # Nothing deleted is either a missing recipe or a recipe without ingredients
+        if result.rowcount==0 and not self._recipe_exists(session,recipe):
+            raise NotFoundError("Recipe Not Found.")
+        if self.flush_session(session):
+            return result.rowcount
 
     def get_random_recipe(self,session:Session)->Recipe:
         """
         Retrieves a single random recipe from the database.
+        The recipe is picked from the cached recipe IDs, so only the chosen row is loaded.
 
         Args:
             session (Session): The active SQLAlchemy session.
 
+        Raises:
+            NotFoundError: If there are no recipes in the database.
+
         Returns:
             Recipe: A randomly selected Recipe object.
         """
-        recipes=session.scalars(select(Recipe)).all()
-        return random.choice(recipes)
+        recipe_ids=self._cached_recipe_ids(session)
+        if recipe_ids:
+            recipe=session.get(Recipe,random.choice(recipe_ids))
+            if recipe:
+                return recipe
+            # The cached ID was deleted outside this manager; drop the list and let the database pick
+            self._drop_recipe_ids()
+        elif recipe_ids is not None:
+            raise NotFoundError("Recipe Not Found.")
+        recipe=session.scalars(select(Recipe).order_by(func.random()).limit(1)).first()
+        if not recipe:
+            raise NotFoundError("Recipe Not Found.")
+        return recipe
+
+    def _cached_recipe_ids(self,session:Session)->tuple[int,...]| None:
+        """
+        Returns the IDs of all recipes, querying them at most once per RECIPE_ID_CACHE_TTL seconds.
+        With a Redis client the list is shared between worker processes, otherwise it is kept in this one.
+
+        Args:
+            session (Session): The active SQLAlchemy session.
+
+        Returns:
+            tuple[int, ...] | None: The IDs of every recipe in the database, or None if Redis is unreachable.
+        """
+        if self._cache is not None:
+            try:
+                recipe_ids=self._cache.get(RECIPE_IDS_KEY)
+                if recipe_ids is None:
+                    recipe_ids=orjson.dumps(self.get_all_recipe_ids(session))
+                    self._cache.set(RECIPE_IDS_KEY,recipe_ids,ex=RECIPE_ID_CACHE_TTL)
+            except redis.RedisError:
+                return None
+            return tuple(orjson.loads(recipe_ids))
+        now=time.monotonic()
+        if self._all_recipe_ids is None or now-self._all_recipe_ids_loaded_at>RECIPE_ID_CACHE_TTL:
+            self._all_recipe_ids=tuple(self.get_all_recipe_ids(session))
+            self._all_recipe_ids_loaded_at=now
+        return self._all_recipe_ids
+
+    def _drop_recipe_ids(self):
+        """Drops the cached recipe IDs so the next get_random_recipe reloads them."""
+        self._all_recipe_ids=None
+        if self._cache is not None:
+            try:
+                self._cache.delete(RECIPE_IDS_KEY)
+            except redis.RedisError:
+                pass # The list expires after RECIPE_ID_CACHE_TTL
+
+    def _random_recipe_id(self,session:Session)->int| None:
+        """
+        Picks a random recipe ID in the database without loading the Recipe row.
+
+        Args:
+            session (Session): The active SQLAlchemy session.
+
+        Returns:
+            int | None: A random recipe ID, or None if there are no recipes.
+        """
+        return session.scalar(select(Recipe.recipe_id).order_by(func.random()).limit(1))
 
     def get_recipes_from_ingredient(self, session:Session, ingredient_id:int):
         """
@@ -661,16 +1036,34 @@ class DbManager:
             list[Recipe]: A list of Recipe objects that contain all required ingredients.
         """
         # Build a query: select recipes, join to associations, filter by ingredient IDs,
-        # group by recipe, and only include groups where the count of associated ingredients
-        # matches the number of ingredients requested (ensuring ALL are present).
+        # group by recipe, and only include groups where the count of distinct matched ingredients
+        # equals the number of ingredients requested (ensuring ALL are present).
         result = (session.scalars(select(Recipe).join(RecipeIngredient)
             .where(RecipeIngredient.ingredient_id.in_(ingredients))
             .group_by(Recipe.recipe_id)
-            .having(func.count(RecipeIngredient.recipe_ingredients_id) == len(ingredients)))
+            .having(func.count(func.distinct(RecipeIngredient.ingredient_id)) == len(ingredients)))
         .all())
 
         return result
 
+    def get_common_recipe_ids(self, session:Session, ingredients: set[int])->list[int]:
+        """
+        Finds the IDs of recipes that contain *all* ingredients specified in the set.
+        Same query as get_common_recipes, but only the primary key column is fetched.
+
+        Args:
+            session (Session): The active SQLAlchemy session.
+            ingredients (set[int]): A set of ingredient IDs.
+
+        Returns:
+            list[int]: The IDs of the recipes that contain all required ingredients.
+        """
+        return (session.scalars(select(Recipe.recipe_id).join(RecipeIngredient)
+            .where(RecipeIngredient.ingredient_id.in_(ingredients))
+            .group_by(Recipe.recipe_id)
+            .having(func.count(func.distinct(RecipeIngredient.ingredient_id)) == len(ingredients)))
+        .all())
+
     def adjust_recipe_by_servings(self, session:Session,recipe_id:int,servings:int)->dict[Ingredient,float]:
         """
         Calculates the required ingredient quantities for a different number of servings.
@@ -681,27 +1074,22 @@ class DbManager:
             servings (int): The target number of servings.
 
         Raises:
-            NotFoundError: If the recipe is not found.
+            NotFoundError: If the recipe is not found or it has no ingredients.
 
         Returns:
             dict[Ingredient,float]: A dictionary mapping Ingredient objects to their adjusted quantity.
         """
-        try:
-            recipe=self.get_recipe_by_id(session,recipe_id)
-        except NotFoundError as e:
-            raise NotFoundError(e)
-        else:
-            updated_quantities={}
-            recipe_serving=recipe.recipe_servings
-            # Calculate the multiplier needed to scale the ingredients
-            serving_multiplier=(1/recipe_serving)*servings
-            recipe_ingredients=self.get_all_recipe_ingredients(session,recipe_id)
-            for ingredient in recipe_ingredients:
-                recipe_ingredient=ingredient["ingredient"]
-                recipe_quantity=ingredient["quantity"]
-                # Apply the multiplier
-                updated_quantities[recipe_ingredient]=recipe_quantity*serving_multiplier
-            return updated_quantities
+        # One query scales every quantity by servings / recipe_servings inside the database
+        rows=session.execute(select(Ingredient,RecipeIngredient.ingredient_quantity*servings/Recipe.recipe_servings)
+            .select_from(RecipeIngredient)
+            .join(Ingredient)
+            .join(Recipe)
+            .where(RecipeIngredient.recipe_id==recipe_id)).all()
+        if not rows:
+            if not self._recipe_exists(session,recipe_id):
+                raise NotFoundError("Recipe Not Found.")
+            raise NotFoundError("Recipe Ingredients Not found.")
+        return {ingredient:quantity for ingredient,quantity in rows}
 
     def generate_meal_plan(self, session:Session,num_recipes:int)->set[Recipe]:
         """
@@ -712,82 +1100,81 @@ class DbManager:
             session (Session): The active SQLAlchemy session.
             num_recipes (int): The desired number of recipes in the meal plan.
 
+        Raises:
+            NotFoundError: If there are no recipes in the database.
+
         Returns:
             set[Recipe]: A set of unique Recipe objects for the meal plan.
         """
-        recipe_list = set()
         if num_recipes <= 0:
-            return recipe_list
-        # Start with a random recipe
-        first_recipe = self.get_random_recipe(session)
-        recipe_list.add(first_recipe)
-        current_recipe = first_recipe
+            return set()
+        # Walk the plan with recipe IDs only; Recipe objects are loaded once at the end
+        first_recipe_id = self._random_recipe_id(session)
+        if first_recipe_id is None:
+            raise NotFoundError("Recipe Not Found.")
+        selected_ids = {first_recipe_id}
+        current_recipe_id = first_recipe_id
         # Loop until the desired number of recipes is reached
-        while len(recipe_list) < num_recipes:
-            overlapping_recipes = set()
-            # Get ingredients for the current recipe
-            recipe_ingredient=self.get_all_recipe_ingredients(session,current_recipe.recipe_id)
-
-            # Find all recipes that share at least one ingredient with the current recipe
-            for ingredient in range(len(recipe_ingredient)):
-                try:
-                    # Get all recipes that use the current ingredient
-                    recipes_with_ingredient = self.get_recipes_from_ingredient(session,recipe_ingredient[ingredient]["ingredient"].ingredient_id)
-                    overlapping_recipes.update(recipes_with_ingredient)
-                except ValueError: # Catch potential errors during iteration/retrieval
-                    continue
-
-            # Identify potential next recipes: those that overlap but haven't been added yet
-            potential_next_recipes = overlapping_recipes - recipe_list
-
-            # If no overlapping, unselected recipes are found, fall back to any unselected recipe
-            if not potential_next_recipes:
-                all_recipes =self.get_all_recipes(session)
-                if not all_recipes:
-                    break # No recipes in the DB
-                potential_next_recipes = set(all_recipes) - recipe_list
-
-            if not potential_next_recipes:
+        while len(selected_ids) < num_recipes:
+            # Ingredients of the current recipe, used as a subquery rather than fetched
+            ingredient_ids = (select(RecipeIngredient.ingredient_id)
+                              .where(RecipeIngredient.recipe_id == current_recipe_id))
+
+            # Pick a random recipe that shares at least one ingredient with the current recipe
+            # and hasn't been added yet; one statement does the match, the exclusion and the pick
+            next_recipe_id = session.scalar(select(Recipe.recipe_id)
+                .where(Recipe.recipe_id.in_(select(RecipeIngredient.recipe_id)
+                                            .where(RecipeIngredient.ingredient_id.in_(ingredient_ids))))
+                .where(Recipe.recipe_id.notin_(selected_ids))
+                .order_by(func.random())
+                .limit(1))
+
+            # If no overlapping, unselected recipe is found, fall back to any unselected recipe
+            if next_recipe_id is None:
+                next_recipe_id = session.scalar(select(Recipe.recipe_id)
+                    .where(Recipe.recipe_id.notin_(selected_ids))
+                    .order_by(func.random())
+                    .limit(1))
+
+            if next_recipe_id is None:
                 break # All recipes have been added
 
-            # Select the next recipe randomly from the potential list
-            next_recipe = random.choice(list(potential_next_recipes))
-            recipe_list.add(next_recipe)
-            current_recipe = next_recipe # Move to the next recipe for the next iteration
-        return recipe_list
+            selected_ids.add(next_recipe_id)
+            current_recipe_id = next_recipe_id # Move to the next recipe for the next iteration
+        return set(session.scalars(select(Recipe).where(Recipe.recipe_id.in_(selected_ids))).all())
 
 
-    def get_shopping_list(self,session:Session,servings:int, recipe_set:set)-> dict[Ingredient, float]:
+    def get_shopping_list(self,session:Session,servings:int, recipe_set:set[int])-> list[RowMapping]:
         """
         Generates a consolidated shopping list for a set of recipes, adjusted for a target serving size per recipe.
 
-        The final dictionary contains Ingredient objects mapped to their *total* required quantity across all recipes.
+        Each row holds an ingredient and its *total* required quantity across all recipes,
+        summed by the database in a single query.
 
         Args:
             session (Session): The active SQLAlchemy session.
             servings (int): The target number of servings for *each* recipe in the set.
-            recipe_set (set[Recipe]): The set of Recipe objects to include in the list.
+            recipe_set (set[int]): The IDs of the recipes to include in the list.
 
         Returns:
-            dict[Ingredient, float]: A dictionary of Ingredient objects and their total required quantity.
+            list[RowMapping]: One mapping per ingredient with 'ingredient_id', 'ingredient_name',
+            'ingredient_unit' and 'quantity', ordered by ingredient ID.
         """
-        shopping_list = {}
-        for recipe in recipe_set:
-            # Get all ingredients and quantities for the current recipe
-            ingredients = self.get_all_recipe_ingredients(session,recipe.recipe_id)
-            # Calculate the multiplier based on the recipe's base servings and the target servings
-            serving_multiplier = (servings / recipe.recipe_servings)
-
-            for ingredient in ingredients:
-                ingredient_object = ingredient["ingredient"]
-                ingredient_id = ingredient_object.ingredient_id
-                # Initialize the entry in the shopping list if it doesn't exist
-                if ingredient_id not in shopping_list:
-                    shopping_list[ingredient_id] = {"object": ingredient_object, "quantity": 0.0}
-
-                # Accumulate the adjusted quantity
-                # current_quantity * serving_multiplier
-                shopping_list[ingredient_id]["quantity"] += ingredient["quantity"] * serving_multiplier
-
-        # Return the final list, mapping the Ingredient object to the total quantity
-        return {item["object"]: item["quantity"] for item in shopping_list.values()}
+        # Scale each quantity from its recipe's base servings to the target servings and sum per ingredient
+        return session.execute(select(Ingredient.ingredient_id, Ingredient.ingredient_name, Ingredient.ingredient_unit,
+                                      func.sum(RecipeIngredient.ingredient_quantity * servings / Recipe.recipe_servings).label("quantity"))
+            .select_from(RecipeIngredient)
+            .join(Recipe)
+            .join(Ingredient)
+            .where(RecipeIngredient.recipe_id.in_(recipe_set))
+            .group_by(Ingredient.ingredient_id, Ingredient.ingredient_name, Ingredient.ingredient_unit)
+            .order_by(Ingredient.ingredient_id)).mappings().all()
+
+
+if __name__ == "__main__":
+    # Upgrades the database named by ENGINE, e.g. after updating from a version without the association indexes
+    import os
+    from dotenv import load_dotenv
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    DbManager(os.getenv("ENGINE")).upgrade_database()
@@ -1,15 +1,91 @@
-from fastapi import FastAPI 
-from fastapi.responses import JSONResponse 
+from fastapi import FastAPI, Depends, Request, Query, Body
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from sqlalchemy.exc import IntegrityError
-from db_manager import DbManager,NotFoundError,OtherError
-from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from db_manager import DbManager,NotFoundError,ConflictError,OtherError
+from pydantic import BaseModel, ValidationError
+import orjson
 from dotenv import load_dotenv
+from typing import Annotated, Iterator
+from functools import wraps
+import redis
 import os
 
 load_dotenv()
 engine = os.getenv("ENGINE")
-db=DbManager(engine)
+workers = int(os.getenv("WEB_CONCURRENCY", 4))
+# Connections all workers may hold together; keep it below the database's max_connections
+# (100 by default on PostgreSQL), leaving room for admin and migration sessions
+db_max_connections = int(os.getenv("DB_MAX_CONNECTIONS", 80))
+# Each worker gets an equal share, three quarters kept open and the rest as overflow
+pool_size = int(os.getenv("DB_POOL_SIZE", max(db_max_connections // workers * 3 // 4, 1)))
+max_overflow = int(os.getenv("DB_MAX_OVERFLOW", max(db_max_connections // workers - pool_size, 0)))
+
+# Optional Redis cache for the read-heavy GET endpoints and the random-recipe ID list, disabled when REDIS_URL is unset
+redis_url = os.getenv("REDIS_URL")
+cache = redis.Redis.from_url(redis_url) if redis_url else None
+CACHE_TTL = int(os.getenv("CACHE_TTL", 60))
+
+db=DbManager(engine,pool_size,max_overflow,cache)
+
+def get_db_session()->Iterator[Session]:
+    """
+    Provides one session per request, committed once after the handler returns
+    and rolled back if it raises (see DbManager.transaction).
+    """
+    with db.transaction() as session:
+        yield session
+    drop_cached(*session.info.get("stale_cache_keys", ()))
+
+# "function" scope ends the transaction before the response is sent, so commit errors still reach the client
+SessionDep = Annotated[Session, Depends(get_db_session, scope="function")]
+
+def cached(key:str):
+    """
+    Caches a GET handler's JSON response in Redis for CACHE_TTL seconds.
+    The key is formatted with the handler's path parameters, e.g. "recipes:{recipe_id}".
+    Falls through to the handler when Redis is not configured or unreachable.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(**kwargs):
+            if cache is None:
+                return handler(**kwargs)
+            cache_key = key.format(**kwargs)
+            try:
+                body = cache.get(cache_key)
+            except redis.RedisError:
+                return handler(**kwargs)
+            if body is None:
+                body = orjson.dumps(jsonable_encoder(handler(**kwargs)), option=orjson.OPT_NON_STR_KEYS)
+                try:
+                    cache.setex(cache_key, CACHE_TTL, body)
+                except redis.RedisError:
+                    pass
+            return Response(content=body, media_type="application/json")
+        return wrapper
+    return decorator
+
+def drop_cached(*keys:str):
+    """Drops cached responses; entries Redis can't delete expire after CACHE_TTL."""
+    if cache is None:
+        return
+    try:
+        cache.delete(*keys)
+    except redis.RedisError:
+        pass
+
+def invalidate_on_commit(session:Session, *keys:str):
+    """
+    Marks cached responses as stale for a write made in this request's session.
+    get_db_session drops them only after the transaction commits, so a concurrent GET
+    can't re-cache the old rows, and a rolled-back write leaves the cache untouched.
+    """
+    session.info.setdefault("stale_cache_keys", set()).update(keys)
 
 
 class Ingredient(BaseModel):
@@ -52,50 +128,110 @@ class RecipeIngredient(BaseModel):
     ingredient_id: int
     quantity: float
 
+class BulkRecipeIngredients(BaseModel):
+    """Pydantic model for adding several ingredients to a recipe in one request."""
+    items: list[RecipeIngredient]
+
 class QuantityUpdate(BaseModel):
     """Pydantic model for updating the quantity of an existing recipe ingredient association."""
     quantity: float
 
-app= FastAPI()
+def json_body(model:type[BaseModel]):
+    """
+    Builds a dependency that validates the raw request body with model_validate_json,
+    parsing and validating the JSON in one pass instead of json.loads followed by validation.
+    Invalid bodies still produce FastAPI's usual 422 response.
+    """
+    async def parse(request: Request):
+        try:
+            return model.model_validate_json(await request.body())
+        except ValidationError as e:
+            raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors()])
+    return parse
+
+# Schemas of the json_body models and their nested models, added to the OpenAPI components
+json_body_schemas: dict[str, dict] = {}
+
+def json_body_docs(model:type[BaseModel])->dict:
+    """
+    Documents a json_body request body in the OpenAPI schema, which FastAPI can't infer from the dependency.
+    The model and any nested models are registered as components and referenced from the operation.
+    """
+    schema = model.model_json_schema(ref_template="#/components/schemas/{model}")
+    json_body_schemas.update(schema.pop("$defs", {}))
+    json_body_schemas[model.__name__] = schema
+    return {"requestBody": {"required": True,
+                            "content": {"application/json": {"schema": {"$ref": f"#/components/schemas/{model.__name__}"}}}}}
+
+class OrjsonResponse(JSONResponse):
+    """JSON response rendered with orjson, which encodes the large list endpoints several times faster."""
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+app= FastAPI(default_response_class=OrjsonResponse)
+
+def openapi()->dict:
+    """Builds the OpenAPI schema with the json_body models registered under components."""
+    if app.openapi_schema is None:
+        schema = FastAPI.openapi(app)
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(json_body_schemas)
+    return app.openapi_schema
 
-origins = [
+app.openapi = openapi
+
+origins = (
     "http://localhost",
     "http://localhost:8080",
     "http://localhost:5173"
-]
+)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=("GET", "POST", "PATCH", "DELETE"),
+    allow_headers=("Content-Type", "Authorization"),
+    max_age=86400, # Browsers cache the preflight response for a day
 )
+# Compress responses over 1 KB, mostly the recipe lists and meal-plan payloads
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=5)
 
 
 @app.exception_handler(NotFoundError)
-async def not_found_exception_handler(exc: NotFoundError):
+async def not_found_exception_handler(request: Request, exc: NotFoundError):
     """Handles custom NotFoundError and returns a 404 response."""
-    return JSONResponse(
+    return OrjsonResponse(
         status_code=404,
-        content={"detail": exc.args[0]}, # exc.detail contains the message from the exception
+        content={"detail": exc.detail},
+    )
+
+@app.exception_handler(ConflictError)
+async def conflict_exception_handler(request: Request, exc: ConflictError):
+    """Handles custom ConflictError (e.g., duplicate name or association) and returns a 409 response."""
+    return OrjsonResponse(
+        status_code=409,
+        content={"detail": exc.detail},
     )
+
 @app.exception_handler(IntegrityError)
-async def integrity__exception_handler(exc: IntegrityError):
-    """Handles SQLAlchemy IntegrityError (e.g., unique constraint violation) and returns a 409 response."""
-    return JSONResponse(
+async def integrity__exception_handler(request: Request, exc: IntegrityError):
+    """Handles SQLAlchemy IntegrityError raised outside commit/flush (e.g., a foreign key violation) and returns a 409 response."""
+    return OrjsonResponse(
         status_code=409,
-        content={"detail": exc.args[0]}, # exc.detail contains the message from the exception
+        content={"detail": str(exc.orig)},
     )
 
 @app.exception_handler(OtherError)
-async def other_exception_handler(exc: OtherError):
+async def other_exception_handler(request: Request, exc: OtherError):
     """Handles custom OtherError (for general database errors) and returns a 500 response."""
-    return JSONResponse(
+    return OrjsonResponse(
         status_code=500,
-        content={"detail": exc.args[0]}, # exc.detail contains the message from the exception
+        content={"detail": exc.detail},
     )
 
+# Handlers that touch the database are plain `def`: FastAPI runs them in its threadpool,
+# so blocking driver calls don't stall the event loop for other requests.
+
 # --- General Endpoint ---
 
 @app.get("/")
@@ -106,204 +242,221 @@ async def root():
 # --- Ingredient Endpoints ---
 
 @app.get("/ingredients")
-async def all_ingredients():
+@cached("ingredients:all")
+def all_ingredients(session: SessionDep):
     """
     Retrieves a list of all ingredients in the database.
     """
-    with db.get_session() as session:
-        return db.get_all_ingredients(session)
+    return db.get_all_ingredients_lightweight(session)
 
 @app.get("/ingredients/{ingredient_id}")
-async def get_ingredient(ingredient_id:int):
+@cached("ingredients:{ingredient_id}")
+def get_ingredient(ingredient_id:int, session: SessionDep):
     """
     Retrieves a single ingredient by its ID.
     Raises 404 if the ingredient is not found.
     """
-    with db.get_session() as session:
-        return db.get_ingredient_by_id(session,ingredient_id)
+    return db.get_ingredient_by_id(session,ingredient_id)
 
-@app.post("/ingredients")
-async def add_ingredient(ingredient: Ingredient):
+@app.post("/ingredients", openapi_extra=json_body_docs(Ingredient))
+def add_ingredient(ingredient: Annotated[Ingredient, Depends(json_body(Ingredient))], session: SessionDep):
     """
     Creates a new ingredient in the database.
     Body: Ingredient (Pydantic model).
     Raises 409 if an ingredient with the same name already exists.
     """
-    with db.get_session() as session:
-        return db.add_ingredient(session,ingredient.ingredient_name
-                                 ,ingredient.ingredient_description
-                                 ,ingredient.ingredient_unit
-                                 )
+    invalidate_on_commit(session, "ingredients:all")
+    return db.add_ingredient(session,ingredient.ingredient_name
+                             ,ingredient.ingredient_description
+                             ,ingredient.ingredient_unit
+                             )
 
 @app.delete("/ingredients/{ingredient_id}")
-async def delete_ingredient(ingredient_id:int):
+def delete_ingredient(ingredient_id:int, session: SessionDep):
     """
     Deletes an ingredient by its ID.
     Raises 404 if the ingredient is not found.
     """
-    with db.get_session() as session:
-        return db.delete_ingredient_by_id(session,ingredient_id)
+    invalidate_on_commit(session, "ingredients:all", f"ingredients:{ingredient_id}")
+    return db.delete_ingredient_by_id(session,ingredient_id)
 
-@app.patch("/ingredients/{ingredient_id}")
-async def update_ingredient(ingredient_id:int, ingredient:UpdateIngredient):
+@app.patch("/ingredients/{ingredient_id}", openapi_extra=json_body_docs(UpdateIngredient))
+def update_ingredient(ingredient_id:int, ingredient: Annotated[UpdateIngredient, Depends(json_body(UpdateIngredient))], session: SessionDep):
     """
     Updates one or more attributes of an existing ingredient by ID.
     Body: UpdateIngredient (Pydantic model, partial update allowed).
     Raises 404 if the ingredient is not found.
     """
-    # Convert Pydantic model to dict, excluding fields that weren't provided (None)
-    update_data = ingredient.model_dump(exclude_unset=True)
-    with db.get_session() as session:
-        return db.update_ingredient_by_id(session,ingredient_id,**update_data)
+    # Read only the fields the client sent, without dumping the whole model
+    update_data = {field: getattr(ingredient, field) for field in ingredient.model_fields_set}
+    invalidate_on_commit(session, "ingredients:all", f"ingredients:{ingredient_id}")
+    return db.update_ingredient_by_id(session,ingredient_id,**update_data)
 
 # --- Recipe Endpoints ---
 
 @app.get("/recipes")
-async def all_recipes():
+@cached("recipes:all")
+def all_recipes(session: SessionDep):
     """
     Retrieves a list of all recipes in the database.
+    Instructions are omitted; fetch a single recipe to get them.
     """
-    with db.get_session() as session:
-            return db.get_all_recipes(session)
+    return db.get_all_recipes(session)
 
 
-@app.post("/recipes")
-async def create_recipe(recipe: Recipe):
+@app.post("/recipes", openapi_extra=json_body_docs(Recipe))
+def create_recipe(recipe: Annotated[Recipe, Depends(json_body(Recipe))], session: SessionDep):
     """
     Creates a new recipe in the database.
     Body: Recipe (Pydantic model).
     Raises 409 if a recipe with the same name already exists.
     """
-    with db.get_session() as session:
-        return db.add_recipe(session,recipe.recipe_name,recipe.recipe_description
-                             , recipe.recipe_instructions,recipe.recipe_servings
-                             , recipe.recipe_cooking_time, recipe.recipe_prep_time
-                             , recipe.recipe_calories, recipe.recipe_protein
-                             , recipe.recipe_fat, recipe.recipe_carbs)
+    invalidate_on_commit(session, "recipes:all")
+    return db.add_recipe(session,recipe.recipe_name,recipe.recipe_description
+                         , recipe.recipe_instructions,recipe.recipe_servings
+                         , recipe.recipe_cooking_time, recipe.recipe_prep_time
+                         , recipe.recipe_calories, recipe.recipe_protein
+                         , recipe.recipe_fat, recipe.recipe_carbs)
 
 @app.get("/recipes/{recipe_id}")
-async def get_recipe(recipe_id:int):
+@cached("recipes:{recipe_id}")
+def get_recipe(recipe_id:int, session: SessionDep):
     """
     Retrieves a single recipe by its ID.
     Raises 404 if the recipe is not found.
     """
-    with db.get_session() as session:
-        return db.get_recipe_by_id(session,recipe_id)
+    return db.get_recipe_by_id(session,recipe_id)
 
-@app.patch("/recipes/{recipe_id}")
-async def update_recipe(recipe_id:int, recipe:UpdateRecipe):
+@app.patch("/recipes/{recipe_id}", openapi_extra=json_body_docs(UpdateRecipe))
+def update_recipe(recipe_id:int, recipe: Annotated[UpdateRecipe, Depends(json_body(UpdateRecipe))], session: SessionDep):
     """
     Updates one or more attributes of an existing recipe by ID.
     Body: UpdateRecipe (Pydantic model, partial update allowed).
     Raises 404 if the recipe is not found.
     """
-    # Convert Pydantic model to dict, excluding fields that weren't provided (None)
-    update_data = recipe.model_dump(exclude_unset=True)
-    with db.get_session() as session:
-        return db.update_recipe_by_id(session,recipe_id,**update_data)
+    # Read only the fields the client sent, without dumping the whole model
+    update_data = {field: getattr(recipe, field) for field in recipe.model_fields_set}
+    invalidate_on_commit(session, "recipes:all", f"recipes:{recipe_id}")
+    return db.update_recipe_by_id(session,recipe_id,**update_data)
 
 @app.delete("/recipes/{recipe_id}")
-async def delete_recipe(recipe_id:int):
+def delete_recipe(recipe_id:int, session: SessionDep):
     """
     Deletes a recipe by its ID. This also deletes all associated recipe-ingredient links.
     Raises 404 if the recipe is not found.
     """
-    with db.get_session() as session:
-        return db.delete_recipe_by_id(session,recipe_id)
+    invalidate_on_commit(session, "recipes:all", f"recipes:{recipe_id}")
+    return db.delete_recipe_by_id(session,recipe_id)
 
 # --- Recipe Ingredient Association Endpoints ---
 
 @app.get("/recipes/{recipe_id}/ingredients")
-async def all_recipe_ingredients(recipe_id:int):
+def all_recipe_ingredients(recipe_id:int, session: SessionDep):
     """
     Retrieves all ingredients and their quantities for a specific recipe.
     Raises 404 if the recipe or its ingredients are not found.
     """
-    with db.get_session() as session:
-        return db.get_all_recipe_ingredients(session,recipe_id)
+    # Keep the endpoint's {ingredient, quantity} response shape
+    return [{"ingredient": row.ingredient,"quantity": row.ingredient_quantity}
+            for row in db.get_all_recipe_ingredients(session,recipe_id)]
 
-@app.post("/recipes/{recipe_id}/ingredients")
-async def create_recipe_ingredient(recipe_id:int,recipe_ing: RecipeIngredient):
+@app.post("/recipes/{recipe_id}/ingredients", openapi_extra=json_body_docs(RecipeIngredient))
+def create_recipe_ingredient(recipe_id:int,recipe_ing: Annotated[RecipeIngredient, Depends(json_body(RecipeIngredient))], session: SessionDep):
     """
     Adds an ingredient to a recipe with a specified quantity.
     Body: RecipeIngredient (Pydantic model).
     Raises 404 if the recipe/ingredient ID is invalid.
     Raises 409 if the ingredient is already associated with the recipe.
     """
-    with db.get_session() as session:
-        return db.add_recipe_ingredients(session,recipe_id, recipe_ing.ingredient_id, recipe_ing.quantity)
+    return db.add_recipe_ingredients(session,recipe_id, recipe_ing.ingredient_id, recipe_ing.quantity)
+
+@app.post("/recipes/{recipe_id}/ingredients/bulk", openapi_extra=json_body_docs(BulkRecipeIngredients))
+def create_recipe_ingredients_bulk(recipe_id:int,recipe_ings: Annotated[BulkRecipeIngredients, Depends(json_body(BulkRecipeIngredients))], session: SessionDep):
+    """
+    Adds several ingredients to a recipe in a single insert and commit.
+    Body: BulkRecipeIngredients (Pydantic model).
+    Ingredients already associated with the recipe are skipped.
+    Raises 404 if the recipe or any of the ingredients are not found.
+    """
+    return db.add_recipe_ingredients_bulk(session,recipe_id,
+                                          [(item.ingredient_id,item.quantity) for item in recipe_ings.items])
 
 @app.get("/recipes/{recipe_id}/ingredients/{ingredient_id}")
-async def get_recipe_ingredient(recipe_id:int,ingredient_id:int):
+def get_recipe_ingredient(recipe_id:int,ingredient_id:int, session: SessionDep):
     """
     Retrieves the quantity of a specific ingredient within a specific recipe.
     Raises 404 if the recipe or the association is not found.
     """
-    with db.get_session() as session:
-        return db.get_recipe_ingredient(session,recipe_id,ingredient_id)
+    return db.get_recipe_ingredient(session,recipe_id,ingredient_id)
 
-@app.patch("/recipes/{recipe_id}/ingredients/{ingredient_id}")
-async def update_recipe_ingredient(recipe_id:int,ingredient_id:int,quantity:QuantityUpdate):
+@app.patch("/recipes/{recipe_id}/ingredients/{ingredient_id}", openapi_extra=json_body_docs(QuantityUpdate))
+def update_recipe_ingredient(recipe_id:int,ingredient_id:int,quantity: Annotated[QuantityUpdate, Depends(json_body(QuantityUpdate))], session: SessionDep):
     """
     Updates the quantity of a specific ingredient in a specific recipe.
     Body: QuantityUpdate (Pydantic model).
     Raises 404 if the recipe or the association is not found.
     """
-    with db.get_session() as session:
-        return db.update_recipe_qty(session,recipe_id,ingredient_id,quantity.quantity)
+    return db.update_recipe_qty(session,recipe_id,ingredient_id,quantity.quantity)
 
 @app.delete("/recipes/{recipe_id}/ingredients")
-async def delete_recipe_ingredients(recipe_id:int):
+def delete_recipe_ingredients(recipe_id:int, session: SessionDep):
     """
     Deletes ALL ingredient associations for a given recipe.
     Raises 404 if the recipe is not found.
     """
-    with db.get_session() as session:
-        return db.delete_all_recipe_ingredients(session,recipe_id)
+    return db.delete_all_recipe_ingredients(session,recipe_id)
 
 @app.delete("/recipes/{recipe_id}/ingredients/{ingredient_id}")
-async def delete_recipe_ingredient(recipe_id:int,ingredient_id:int):
+def delete_recipe_ingredient(recipe_id:int,ingredient_id:int, session: SessionDep):
     """
     Deletes a specific ingredient association from a recipe.
     Raises 404 if the recipe or the association is not found.
     """
-    with db.get_session() as session:
-        return db.delete_recipe_ingredient(session,recipe_id,ingredient_id)
+    return db.delete_recipe_ingredient(session,recipe_id,ingredient_id)
 
 # --- Meal Planning Endpoints ---
 
 @app.get("/mealplan/randomrecipe")
-async def get_random_recipe():
+def get_random_recipe(session: SessionDep):
     """
     Retrieves a single random recipe.
     """
-    with db.get_session()as session:
-        return db.get_random_recipe(session)
+    return db.get_random_recipe(session)
 
 @app.get("/mealplan/recipes/")
-async def get_recipes_from_ingredient(ingredients:set):
+def get_recipes_from_ingredient(ingredients: Annotated[set[int], Query()], session: SessionDep):
     """
     Retrieves recipes that contain ALL ingredients specified in the query parameter set.
     Query Parameter: ingredients (a set of ingredient IDs).
     """
-    with db.get_session()as session:
-        return db.get_common_recipes(session,ingredients)
+    return db.get_common_recipes(session,ingredients)
 #Update to request the information as a parameter
 @app.get("/mealplan/plan")
-async def get_meal_plan(recipe_nr:int):
+def get_meal_plan(recipe_nr:int, session: SessionDep):
     """
     Generates a meal plan (a set of recipes) trying to link them by shared ingredients.
     Query Parameter: recipe_nr (the desired number of recipes).
     """
-    with db.get_session() as session:
-        return db.generate_meal_plan(session,recipe_nr)
+    return db.generate_meal_plan(session,recipe_nr)
 
 @app.post("/mealplan/shopping")
-async def generate_shopping_list(servings:int,recipes:set):
+def generate_shopping_list(servings:int, recipes: Annotated[set[int], Body()], session: SessionDep):
     """
     Generates a consolidated shopping list for a set of recipes, adjusted for a target serving size.
     Query Parameter: servings (the target servings for each recipe).
     Body: recipes (a set of Recipe IDs).
     """
-    with db.get_session() as session:
-        return db.get_shopping_list(session,servings,recipes)
+    return db.get_shopping_list(session,servings,recipes)
+
+if __name__ == "__main__":
+    import uvicorn
+    # Each worker is a separate process with its own engine and pool; the pools are
+    # sized from WEB_CONCURRENCY and DB_MAX_CONNECTIONS above.
+    # "auto" picks uvloop and httptools when installed (fastapi[standard] ships both on Linux/macOS).
+    uvicorn.run("main:app",
+                host=os.getenv("HOST", "0.0.0.0"),
+                port=int(os.getenv("PORT", 8000)),
+                workers=workers,
+                loop="auto",
+                http="auto",
+                access_log=False)